@@ -1,13 +1,73 @@
 # In main.py
 
 # --- Standard Library Imports ---
+import asyncio
+import json
+import logging
+import logging.handlers
+import queue
+from enum import Enum
 import tempfile
 import os
 import shutil
+import re
+import sys
+import hashlib
+import time
+import threading
+from collections import OrderedDict
 
 # --- FastAPI and Typing Imports ---
-from fastapi import FastAPI, UploadFile, File, Query, BackgroundTasks, HTTPException
-from typing import List, Optional, Dict, Any
+from fastapi import FastAPI, UploadFile, File, Query, HTTPException, Request
+from fastapi.responses import ORJSONResponse, StreamingResponse, Response
+from starlette.concurrency import run_in_threadpool
+from typing import List, Optional, Dict, Any, Tuple, Callable, AsyncIterator, Iterator
+
+# --- Serialization Import ---
+import orjson
+
+# --- Logging Setup ---
+# Request handlers only enqueue log records; a background QueueListener thread
+# does the actual (locking, blocking) writes to stderr. The listener starts at
+# import, so output never depends on lifespan events firing; shutdown stops it
+# (flushing the queue) and a later startup starts it again.
+log = logging.getLogger("osm_api")
+log.setLevel(logging.INFO)
+log.propagate = False
+_log_queue: "queue.Queue[logging.LogRecord]" = queue.Queue(-1)
+_log_stream_handler = logging.StreamHandler()
+_log_stream_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+log.addHandler(logging.handlers.QueueHandler(_log_queue))
+_log_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def _start_log_listener():
+    """Starts the log queue listener, unless it is already running."""
+    global _log_listener
+    if _log_listener is None:
+        _log_listener = logging.handlers.QueueListener(_log_queue, _log_stream_handler)
+        _log_listener.start()
+
+
+def _stop_log_listener():
+    """Flushes queued log records and stops the listener, if it is running."""
+    global _log_listener
+    if _log_listener is not None:
+        _log_listener.stop()
+        _log_listener = None
+
+
+_start_log_listener()
+
+# --- Optional Persistent Cache Imports ---
+# The on-disk result cache is only enabled when both packages are installed
+try:
+    import msgpack
+    import zstandard
+except ImportError:
+    log.warning("msgpack/zstandard not installed; persistent result cache disabled.")
+    msgpack = None
+    zstandard = None
 
 # --- OpenStudio Import ---
 import openstudio
@@ -16,9 +76,9 @@ import openstudio
 # === Utility function import ===
 try:
     from OpenStudio_Toolkit.utils.osm_utils import load_osm_file_as_model
-    print("Successfully imported 'load_osm_file_as_model' from toolkit utils.")
+    log.info("Successfully imported 'load_osm_file_as_model' from toolkit utils.")
 except ImportError:
-    print(f"ERROR: Could not import 'load_osm_file_as_model' from OpenStudio_Toolkit.utils.osm_utils.")
+    log.error("Could not import 'load_osm_file_as_model' from OpenStudio_Toolkit.utils.osm_utils.")
     load_osm_file_as_model = None
 
 # === Object parsing function imports ===
@@ -27,9 +87,9 @@ try:
     from OpenStudio_Toolkit.osm_objects.spaces import get_all_space_objects_as_dicts
     from OpenStudio_Toolkit.osm_objects.surfaces import get_all_surface_objects_as_dicts
     from OpenStudio_Toolkit.osm_objects.subsurfaces import get_all_subsurface_objects_as_dicts
-    print("Core parsing functions (spaces, surfaces, subsurfaces) imported successfully.")
+    log.info("Core parsing functions (spaces, surfaces, subsurfaces) imported successfully.")
 except ImportError as e:
-    print(f"ERROR: Could not import one or more core parsing functions. Error: {e}")
+    log.error("Could not import one or more core parsing functions. Error: %s", e)
     # Define placeholders if imports fail
     get_all_space_objects_as_dicts = None
     get_all_surface_objects_as_dicts = None
@@ -43,70 +103,637 @@ app = FastAPI(
     title="OpenStudio OSM Parser API",
     description="API to parse OpenStudio (OSM) files and extract building model information.",
     version="0.1.0",
+    # Parsed results can be very large; orjson serializes them much faster than stdlib json
+    default_response_class=ORJSONResponse,
 )
 
-# Define the list of object types your parser will support
-# (Update this list based on what your OpenStudio-Toolkit can actually parse)
-VALID_OBJECT_TYPES = [
-    "spaces",
-    "surfaces",
-    "subsurfaces"
-]
+# Define the object types your parser will support
+# (Update this enum based on what your OpenStudio-Toolkit can actually parse).
+# Used as the query parameter type, so FastAPI rejects unknown values before the endpoint runs.
+class ObjectType(str, Enum):
+    spaces = "spaces"
+    surfaces = "surfaces"
+    subsurfaces = "subsurfaces"
+
+
+VALID_OBJECT_TYPES = [obj_type.value for obj_type in ObjectType]
+
+# Chunk size used when streaming the upload to disk (1 MB)
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Maximum number of loaded OpenStudio models kept in memory (LRU, keyed by content SHA-256)
+MODEL_CACHE_MAXSIZE = 32
+
+# Maximum number of parsed (content SHA-256, object type) results kept in memory
+RESULT_CACHE_MAXSIZE = 128
+
+# Directory for the persistent result cache, shared across restarts and workers.
+# Point it at a persistent volume in deployment. The app only ever writes to (and
+# evicts from) its own CACHE_RESULTS_DIR subdirectory, so CACHE_DIR may be shared.
+CACHE_DIR = os.environ.get("OSM_API_CACHE_DIR", os.path.join(tempfile.gettempdir(), "osm_api_cache"))
+CACHE_RESULTS_DIR = os.path.join(CACHE_DIR, "osm_api_results") # <parser version>/<sha>/<obj_type>.msgpack.zst
+
+# Persisted results not read for this long are evicted, and the oldest entries are
+# evicted once the cache grows beyond CACHE_MAX_BYTES
+CACHE_MAX_AGE_SECONDS = 7 * 24 * 60 * 60
+CACHE_MAX_BYTES = 1024 * 1024 * 1024
+
+# Interval between sweeps of CACHE_RESULTS_DIR
+CACHE_SWEEP_INTERVAL_SECONDS = 10 * 60
+
+# zstandard compression level for persisted results
+CACHE_ZSTD_LEVEL = 3
+
+# Uploads up to this size are first loaded straight from memory (no temp file round-trip);
+# larger uploads, and any the in-memory loader rejects, are spilled to disk and
+# loaded with the toolkit's file-based loader.
+IN_MEMORY_LOAD_MAX_BYTES = 64 * 1024 * 1024
+
+# Uploads larger than this are rejected with 413
+MAX_UPLOAD_BYTES = 256 * 1024 * 1024
+
+# Cap on concurrent heavy operations (model loads and object parsers) across all requests,
+# so bursts of uploads queue up instead of loading many large models into memory at once
+_PARSE_SEM = asyncio.Semaphore(max(2, os.cpu_count() or 1))
+
+# --- Upload Size Limit ---
+
+class UploadSizeLimitMiddleware:
+    """
+    ASGI middleware that rejects /parse requests whose Content-Length exceeds
+    MAX_UPLOAD_BYTES with 413. It runs before FastAPI parses the multipart
+    body, so oversized uploads are never read.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"] == "/parse":
+            content_length = dict(scope["headers"]).get(b"content-length", b"")
+            if content_length.isdigit() and int(content_length) > MAX_UPLOAD_BYTES:
+                response = ORJSONResponse(
+                    status_code=413,
+                    content={"detail": f"Uploaded file is too large. Maximum size is {MAX_UPLOAD_BYTES // (1024 * 1024)} MB."},
+                )
+                await response(scope, receive, send)
+                return
+        await self.app(scope, receive, send)
+
+
+app.add_middleware(UploadSizeLimitMiddleware)
 
 # --- Temporary File Handling Functions ---
 
-def save_temp_file(file_content: bytes, filename: str) -> str:
+# Single app-level directory holding all uploaded temp files.
+# (Re)created on every startup, since shutdown removes it.
+TMP_ROOT = tempfile.mkdtemp(prefix="osm_api_")
+
+# Temp copies are unlinked as soon as their model is loaded; the background sweep
+# is a safety net that deletes any left behind (e.g. worker crash) older than this age.
+TEMP_FILE_MAX_AGE_SECONDS = 15 * 60
+
+# Interval between periodic sweeps of TMP_ROOT
+TEMP_SWEEP_INTERVAL_SECONDS = 60
+
+# Number of directory entries processed per sweep batch, and pause between batches
+TEMP_SWEEP_BATCH_SIZE = 100
+TEMP_SWEEP_PAUSE_MS = 50
+
+
+def save_temp_file(file: UploadFile, filename: str) -> Tuple[str, str]:
     """
-    Saves uploaded file content to a temporary file with its original extension
-    and returns the full path to the temporary file.
+    Streams the uploaded file to a temporary file with its original extension
+    and returns the full path to the temporary file together with the
+    SHA-256 hex digest of its content.
+    The upload is copied in fixed-size chunks so it is never held fully in memory.
     """
+    temp_file_path: Optional[str] = None
     try:
-        temp_dir = tempfile.mkdtemp() # Create a temporary directory
-        
         # Get the file extension from the original filename
         # Default to .osm if no extension is found
         file_ext = os.path.splitext(filename)[1] if os.path.splitext(filename)[1] else ".osm"
         
-        # Construct the temporary file path within the created directory
-        # Using a fixed name like 'model' + original extension can be good for OpenStudio
-        temp_file_path = os.path.join(temp_dir, f"uploaded_model{file_ext}")
-        
-        with open(temp_file_path, "wb") as f:
-            f.write(file_content)
-        print(f"Temporary file saved at: {temp_file_path}") # For logging/debugging
-        return temp_file_path
+        hasher = hashlib.sha256()
+        # One reusable buffer: each chunk is read into it once, then hashed and
+        # written from the same memory, without allocating a new bytes object per chunk
+        buffer = bytearray(UPLOAD_CHUNK_SIZE)
+        view = memoryview(buffer)
+        file.file.seek(0)
+        with tempfile.NamedTemporaryFile(dir=TMP_ROOT, suffix=file_ext, delete=False) as f:
+            temp_file_path = f.name
+            while n := file.file.readinto(view):
+                chunk = view[:n]
+                hasher.update(chunk)
+                f.write(chunk)
+        log.info("Temporary file saved at: %s", temp_file_path)
+        return temp_file_path, hasher.hexdigest()
     except Exception as e:
-        print(f"Error saving temp file: {e}")
-        # Clean up directory if file write failed but dir was created
-        if 'temp_dir' in locals() and os.path.exists(temp_dir):
-            shutil.rmtree(temp_dir)
+        log.error("Error saving temp file: %s", e)
+        # Remove the partially written file, if any
+        if temp_file_path:
+            cleanup_temp_file(temp_file_path)
         raise HTTPException(status_code=500, detail=f"Could not save uploaded file: {e}")
 
 
+def hash_upload(file: UploadFile) -> str:
+    """
+    Returns the SHA-256 hex digest of the upload, reading its spooled file in
+    fixed-size chunks so the content is never held fully in memory.
+    """
+    hasher = hashlib.sha256()
+    buffer = bytearray(UPLOAD_CHUNK_SIZE)
+    view = memoryview(buffer)
+    file.file.seek(0)
+    while n := file.file.readinto(view):
+        hasher.update(view[:n])
+    return hasher.hexdigest()
+
+
+def read_upload_bytes(file: UploadFile) -> bytes:
+    """
+    Reads the whole upload into memory. Only used for uploads up to
+    IN_MEMORY_LOAD_MAX_BYTES, and only while a _PARSE_SEM permit is held.
+    """
+    file.file.seek(0)
+    return file.file.read()
+
+
 def cleanup_temp_file(temp_file_path: str):
     """
-    Removes the temporary file and its containing directory.
-    Designed to be run as a background task.
+    Removes the temporary file.
+    Called once the upload's model has been loaded, or when the upload could not be saved.
+    """
+    try:
+        os.unlink(temp_file_path)
+        log.info("Cleaned up temporary file: %s", temp_file_path)
+    except FileNotFoundError:
+        log.warning("Temporary file not found for cleanup: %s", temp_file_path)
+    except Exception as e:
+        # Log error, but don't let cleanup failure crash the app or stop response
+        log.error("Error cleaning up temp file %s: %s", temp_file_path, e)
+
+
+def _sweep_temp_batch(entries: Iterator[os.DirEntry], cutoff: float) -> bool:
+    """
+    Removes stale files among the next TEMP_SWEEP_BATCH_SIZE entries of a TMP_ROOT scan.
+    Returns False once the scan is exhausted.
+    """
+    for _ in range(TEMP_SWEEP_BATCH_SIZE):
+        entry = next(entries, None)
+        if entry is None:
+            return False
+        try:
+            if entry.is_file(follow_symlinks=False) and entry.stat().st_mtime < cutoff:
+                os.unlink(entry.path)
+                log.info("Swept stale temporary file: %s", entry.path)
+        except FileNotFoundError:
+            pass # Already removed
+        except Exception as e:
+            log.error("Error sweeping temp file %s: %s", entry.path, e)
+    return True
+
+
+async def sweep_temp_root(max_age_seconds: float = TEMP_FILE_MAX_AGE_SECONDS):
+    """
+    Removes files in TMP_ROOT older than 'max_age_seconds'.
+    Entries are streamed with os.scandir and processed in batches of
+    TEMP_SWEEP_BATCH_SIZE in a worker thread, pausing between batches so a
+    large backlog of files does not compete with active parses for the disk.
+    """
+    cutoff = time.time() - max_age_seconds
+    entries = await run_in_threadpool(os.scandir, TMP_ROOT)
+    with entries:
+        while await run_in_threadpool(_sweep_temp_batch, entries, cutoff):
+            await asyncio.sleep(TEMP_SWEEP_PAUSE_MS / 1000)
+
+
+async def _temp_sweep_loop():
+    """Periodically sweeps TMP_ROOT for stale temporary files."""
+    while True:
+        await asyncio.sleep(TEMP_SWEEP_INTERVAL_SECONDS)
+        try:
+            await sweep_temp_root()
+        except Exception as e:
+            # Never let a failed sweep stop the loop
+            log.error("Error sweeping temp directory %s: %s", TMP_ROOT, e)
+
+
+@app.on_event("startup")
+async def start_background_sweeps():
+    """Restarts logging if stopped, creates TMP_ROOT and starts the periodic temp file and result cache sweeps."""
+    _start_log_listener()
+    os.makedirs(TMP_ROOT, exist_ok=True)
+    app.state.temp_sweeper = asyncio.create_task(_temp_sweep_loop())
+    app.state.cache_sweeper = asyncio.create_task(_cache_sweep_loop())
+
+
+@app.on_event("shutdown")
+async def stop_background_sweeps():
+    """Stops the periodic sweeps, removes TMP_ROOT and flushes logs on shutdown."""
+    app.state.temp_sweeper.cancel()
+    app.state.cache_sweeper.cancel()
+    shutil.rmtree(TMP_ROOT, ignore_errors=True)
+    # Flush any queued log records
+    _stop_log_listener()
+
+
+# --- Model Loading ---
+
+def load_osm_file_as_model_from_bytes(data: bytes) -> Any:
+    """
+    Loads an OpenStudio model directly from OSM file content, applying version
+    translation like the toolkit's file-based loader but without touching disk.
+    """
+    translator = openstudio.osversion.VersionTranslator()
+    optional_model = translator.loadModelFromString(data.decode("utf-8"))
+    if not optional_model.is_initialized():
+        raise ValueError("OpenStudio could not load the model from the uploaded content.")
+    return optional_model.get()
+
+
+# --- Model Cache ---
+
+# Process-wide LRU cache: content SHA-256 -> loaded openstudio.model.Model
+_MODEL_CACHE: "OrderedDict[str, Any]" = OrderedDict()
+_MODEL_CACHE_LOCK = threading.Lock()
+
+
+def _load_cached(sha_hex: str, load: Callable[[], Any]) -> Any:
+    """
+    Returns the OpenStudio model for the given content hash, calling 'load'
+    only if it is not already cached. Repeat uploads of the same file
+    skip the (expensive) model load/translation entirely.
+    """
+    with _MODEL_CACHE_LOCK:
+        if sha_hex in _MODEL_CACHE:
+            _MODEL_CACHE.move_to_end(sha_hex)
+            log.info("Model cache hit for %s", sha_hex[:12])
+            return _MODEL_CACHE[sha_hex]
+
+    # Load outside the lock so other requests are not blocked by a slow translation
+    model = load()
+
+    with _MODEL_CACHE_LOCK:
+        _MODEL_CACHE[sha_hex] = model
+        _MODEL_CACHE.move_to_end(sha_hex)
+        while len(_MODEL_CACHE) > MODEL_CACHE_MAXSIZE:
+            _MODEL_CACHE.popitem(last=False)
+    return model
+
+
+def _load_upload_model(file: UploadFile, content_sha: str, temp_osm_path: Optional[str]) -> Any:
+    """
+    Loads (or fetches from the model cache) the model for an upload. Runs in a
+    worker thread while a _PARSE_SEM permit is held.
+
+    Uploads already spilled to 'temp_osm_path' are loaded with the toolkit. Otherwise
+    the upload is read into memory only now, on a model cache miss, and loaded from
+    bytes; if that fails (e.g. non-UTF-8 text), it is retried through a temp file
+    and the toolkit's file-based loader.
+    """
+    if temp_osm_path is not None:
+        return _load_cached(content_sha, lambda: load_osm_file_as_model(temp_osm_path))
+
+    try:
+        return _load_cached(content_sha, lambda: load_osm_file_as_model_from_bytes(read_upload_bytes(file)))
+    except Exception as e_mem:
+        log.warning("In-memory model load failed (%s); retrying from a temp file.", e_mem)
+
+    fallback_path, _ = save_temp_file(file, file.filename or "model.osm")
+    try:
+        return _load_cached(content_sha, lambda: load_osm_file_as_model(fallback_path))
+    finally:
+        cleanup_temp_file(fallback_path)
+
+
+# --- Parse Result Cache ---
+
+# Parsers are pure functions of the model, so their output can be keyed by
+# (content SHA-256, object type) and reused across requests for the same file.
+_RESULT_CACHE: "OrderedDict[Tuple[str, str], Any]" = OrderedDict()
+_RESULT_CACHE_LOCK = threading.Lock()
+
+
+def _compute_parser_version() -> str:
+    """
+    Returns a short fingerprint of the code that produces parse results: the
+    OpenStudio version plus the source of every toolkit module. Persisted
+    results live under this version, so a toolkit or OpenStudio upgrade
+    never serves results produced by the old code.
+    """
+    hasher = hashlib.sha256(openstudio.openStudioLongVersion().encode("utf-8"))
+    toolkit = sys.modules.get("OpenStudio_Toolkit")
+    for package_dir in getattr(toolkit, "__path__", []):
+        for root, dirs, files in os.walk(package_dir):
+            dirs.sort()
+            for name in sorted(files):
+                if name.endswith(".py"):
+                    path = os.path.join(root, name)
+                    hasher.update(os.path.relpath(path, package_dir).encode("utf-8"))
+                    with open(path, "rb") as f:
+                        hasher.update(f.read())
+    return hasher.hexdigest()[:16]
+
+
+PARSER_VERSION = _compute_parser_version()
+
+# Names the cache sweep recognizes as its own directories
+_PARSER_VERSION_RE = re.compile(r"[0-9a-f]{16}")
+_CONTENT_SHA_RE = re.compile(r"[0-9a-f]{64}")
+
+
+def _disk_cache_path(sha_hex: str, obj_type: str) -> str:
+    """Returns the persistent cache file path for (sha_hex, obj_type)."""
+    return os.path.join(CACHE_RESULTS_DIR, PARSER_VERSION, sha_hex, f"{obj_type}.msgpack.zst")
+
+
+def _disk_cache_get(sha_hex: str, obj_type: str) -> Optional[Any]:
+    """Reads a persisted parse result, or returns None if missing, disabled or unreadable."""
+    if msgpack is None:
+        return None
+    path = _disk_cache_path(sha_hex, obj_type)
+    try:
+        with open(path, "rb") as f:
+            packed = zstandard.ZstdDecompressor().decompress(f.read())
+        # Refresh the mtime so the sweep evicts least recently used entries first
+        os.utime(path)
+        return msgpack.unpackb(packed, strict_map_key=False)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        log.error("Error reading persistent cache entry %s: %s", path, e)
+        return None
+
+
+def _disk_cache_put(sha_hex: str, obj_type: str, data: Any) -> None:
+    """
+    Persists a parse result. Written to a temp file and moved into place with
+    os.replace, so concurrent readers never see a partially written entry.
+    """
+    if msgpack is None:
+        return
+    path = _disk_cache_path(sha_hex, obj_type)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        compressed = zstandard.ZstdCompressor(level=CACHE_ZSTD_LEVEL).compress(msgpack.packb(data))
+        with tempfile.NamedTemporaryFile(dir=os.path.dirname(path), delete=False) as f:
+            f.write(compressed)
+        os.replace(f.name, path)
+    except Exception as e:
+        # A failed cache write must never fail the request
+        log.error("Error writing persistent cache entry %s: %s", path, e)
+        if "f" in locals() and os.path.exists(f.name):
+            os.unlink(f.name)
+
+
+def sweep_cache_dir():
+    """
+    Evicts persisted results: whole directories of other parser versions,
+    entries not read within CACHE_MAX_AGE_SECONDS, then the least recently
+    used entries until the cache fits in CACHE_MAX_BYTES.
+    Only directories named like a parser version fingerprint (and, below it,
+    like a content SHA-256) are touched; anything else is left alone.
     """
-    if temp_file_path and os.path.exists(temp_file_path):
-        temp_dir = os.path.dirname(temp_file_path)
+    if not os.path.isdir(CACHE_RESULTS_DIR):
+        return
+    with os.scandir(CACHE_RESULTS_DIR) as versions:
+        for version_entry in versions:
+            if (version_entry.name != PARSER_VERSION
+                    and _PARSER_VERSION_RE.fullmatch(version_entry.name)
+                    and version_entry.is_dir(follow_symlinks=False)):
+                shutil.rmtree(version_entry.path, ignore_errors=True)
+                log.info("Evicted persistent cache for parser version %s", version_entry.name)
+
+    version_dir = os.path.join(CACHE_RESULTS_DIR, PARSER_VERSION)
+    if not os.path.isdir(version_dir):
+        return
+    cutoff = time.time() - CACHE_MAX_AGE_SECONDS
+    kept: List[Tuple[float, int, str]] = [] # (mtime, size, path)
+    with os.scandir(version_dir) as sha_entries:
+        for sha_entry in sha_entries:
+            if not (_CONTENT_SHA_RE.fullmatch(sha_entry.name) and sha_entry.is_dir(follow_symlinks=False)):
+                continue
+            with os.scandir(sha_entry.path) as entries:
+                for entry in entries:
+                    try:
+                        stat = entry.stat(follow_symlinks=False)
+                        if stat.st_mtime < cutoff:
+                            os.unlink(entry.path)
+                        else:
+                            kept.append((stat.st_mtime, stat.st_size, entry.path))
+                    except FileNotFoundError:
+                        pass # Replaced or removed concurrently
+            try:
+                os.rmdir(sha_entry.path) # Only succeeds once the directory is empty
+            except OSError:
+                pass
+
+    total_size = sum(size for _, size, _ in kept)
+    for _, size, path in sorted(kept):
+        if total_size <= CACHE_MAX_BYTES:
+            break
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        total_size -= size
+
+
+async def _cache_sweep_loop():
+    """Sweeps CACHE_RESULTS_DIR on startup and then periodically."""
+    while True:
         try:
-            shutil.rmtree(temp_dir) # shutil.rmtree removes a directory and all its contents
-            print(f"Cleaned up temporary directory: {temp_dir}") # For logging/debugging
+            await run_in_threadpool(sweep_cache_dir)
         except Exception as e:
-            # Log error, but don't let cleanup failure crash the app or stop response
-            print(f"Error cleaning up temp directory {temp_dir}: {e}")
-    else:
-        print(f"Temporary file/directory not found for cleanup: {temp_file_path}")
+            # Never let a failed sweep stop the loop
+            log.error("Error sweeping persistent cache %s: %s", CACHE_RESULTS_DIR, e)
+        await asyncio.sleep(CACHE_SWEEP_INTERVAL_SECONDS)
+
+
+def _result_cache_get(sha_hex: str, obj_type: str) -> Optional[Any]:
+    """
+    Returns the cached parse result for (sha_hex, obj_type), or None on a miss.
+    Falls back to the persistent cache, promoting hits into memory.
+    """
+    key = (sha_hex, obj_type)
+    with _RESULT_CACHE_LOCK:
+        if key in _RESULT_CACHE:
+            _RESULT_CACHE.move_to_end(key)
+            return _RESULT_CACHE[key]
+
+    data = _disk_cache_get(sha_hex, obj_type)
+    if data is not None:
+        _result_cache_put(sha_hex, obj_type, data, persist=False)
+    return data
+
+
+def _result_cache_put(sha_hex: str, obj_type: str, data: Any, persist: bool = True) -> None:
+    """
+    Stores a parse result, evicting the least recently used entries beyond the size cap,
+    and (unless 'persist' is False) writes it to the persistent cache.
+    """
+    key = (sha_hex, obj_type)
+    with _RESULT_CACHE_LOCK:
+        _RESULT_CACHE[key] = data
+        _RESULT_CACHE.move_to_end(key)
+        while len(_RESULT_CACHE) > RESULT_CACHE_MAXSIZE:
+            _RESULT_CACHE.popitem(last=False)
+    if persist:
+        _disk_cache_put(sha_hex, obj_type, data)
+
+
+def _get_cached_results(sha_hex: str, obj_types: List[str]) -> Optional[Dict[str, Any]]:
+    """
+    Returns {obj_type: data} if every requested object type is cached (in memory or on disk),
+    or None if any is missing. The returned values are served as-is, so a later eviction
+    cannot leave a request without either a result or a model to parse.
+    """
+    cached_results: Dict[str, Any] = {}
+    for obj_type in obj_types:
+        data = _result_cache_get(sha_hex, obj_type)
+        if data is None:
+            return None
+        cached_results[obj_type] = data
+    return cached_results
+
+
+# --- Object Parsing Dispatch ---
+
+# Maps each object type to its toolkit parsing function (None if the import failed).
+# When adding to VALID_OBJECT_TYPES, register the matching parser here.
+_DISPATCH: Dict[str, Optional[Callable[[Any], Any]]] = {
+    "spaces": get_all_space_objects_as_dicts,
+    "surfaces": get_all_surface_objects_as_dicts,
+    "subsurfaces": get_all_subsurface_objects_as_dicts,
+}
+
+
+def _dispatch(obj_type: str, model: Any, content_sha: str) -> Tuple[str, Any]:
+    """
+    Parses a single object type from the model and returns (obj_type, data).
+    Runs in a worker thread; any exception is propagated to the caller,
+    which maps it to an error entry in the response.
+    """
+    cached = _result_cache_get(content_sha, obj_type)
+    if cached is not None:
+        log.info("Result cache hit for %s", obj_type)
+        return obj_type, cached
+
+    log.info("Processing object type: %s", obj_type)
+
+    parser = _DISPATCH.get(obj_type)
+    if parser is None: # Function was not imported
+        raise ImportError(f"Parsing function for '{obj_type}' not available.")
+    data = parser(model)
+
+    # Data Handling: Assumes your functions return lists of dicts or dicts
+    if data is None:
+        # Function was called, returned None (e.g., no objects of this type found).
+        # Set to an empty list to distinguish from "not selected" (which remains None from init).
+        data = []
+
+    # Only successful results are cached; errors are retried on the next request
+    _result_cache_put(content_sha, obj_type, data)
+    return obj_type, data
+
+
+def _release_parse_permit(future: "asyncio.Future[Any]") -> None:
+    """Done-callback releasing the _PARSE_SEM permit held for a worker thread."""
+    _PARSE_SEM.release()
+    if not future.cancelled():
+        future.exception() # Mark as retrieved in case the awaiting caller was cancelled
+
+
+async def _run_with_parse_permit(func: Callable[..., Any], *args: Any) -> Any:
+    """
+    Runs 'func(*args)' in a worker thread while holding a _PARSE_SEM permit.
+    Threads cannot be interrupted, so the permit is released when the thread
+    finishes rather than when the caller is cancelled (e.g. client disconnect);
+    abandoned work keeps counting against the cap until it completes.
+    """
+    await _PARSE_SEM.acquire()
+    try:
+        future = asyncio.ensure_future(asyncio.to_thread(func, *args))
+    except BaseException:
+        _PARSE_SEM.release()
+        raise
+    future.add_done_callback(_release_parse_permit)
+    return await asyncio.shield(future)
+
+
+async def _parse_object_type(obj_type: str, model: Any, content_sha: str) -> Tuple[str, Any]:
+    """
+    Runs the parser for 'obj_type' in a worker thread and returns (obj_type, data).
+    Failures are mapped to an {"error": ...} dict so one failing parser
+    does not affect the others.
+    """
+    try:
+        return await _run_with_parse_permit(_dispatch, obj_type, model, content_sha)
+    except ImportError as e_imp:
+        log.error("ImportError for parsing function for %s: %s", obj_type, e_imp)
+        return obj_type, {"error": f"Parsing function for {obj_type} not available: {str(e_imp)}"}
+    except Exception as e_parse:
+        log.error("Error parsing %s: %s", obj_type, e_parse)
+        return obj_type, {"error": f"Error processing {obj_type}: {str(e_parse)}"}
+
+
+def _ndjson_line(obj_type: str, data: Any) -> bytes:
+    """
+    Serializes one {"type": ..., "data": ...} NDJSON line with orjson.
+    Falls back to stdlib json (which escapes lone surrogates) for strings orjson
+    rejects, e.g. non-UTF-8 names that OpenStudio returns surrogate-escaped.
+    """
+    line = {"type": obj_type, "data": data}
+    try:
+        return orjson.dumps(line) + b"\n"
+    except TypeError:
+        return json.dumps(line).encode("utf-8") + b"\n"
+
+
+async def _stream_results(
+    types_to_parse: List[str],
+    model: Any,
+    content_sha: str,
+    cached_results: Optional[Dict[str, Any]] = None,
+) -> AsyncIterator[bytes]:
+    """
+    Yields one NDJSON line, {"type": ..., "data": ...}, per object type in
+    the order the parsers complete, so clients can start consuming results
+    before the slowest parser finishes. If 'cached_results' is given, those
+    values are streamed directly and no parser runs.
+    """
+    if cached_results is not None:
+        for obj_type in types_to_parse:
+            yield _ndjson_line(obj_type, cached_results[obj_type])
+        return
+
+    tasks = [asyncio.create_task(_parse_object_type(obj_type, model, content_sha)) for obj_type in types_to_parse]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            obj_type, data = await next_done
+            yield _ndjson_line(obj_type, data)
+    finally:
+        # Client disconnected mid-stream: drop any parsers still pending
+        for task in tasks:
+            task.cancel()
+
+
+def _parse_if_none_match(header_value: Optional[str]) -> List[str]:
+    """Splits an If-None-Match header into its entity tags (weak 'W/' prefixes are ignored)."""
+    if not header_value:
+        return []
+    return [tag.strip().removeprefix("W/") for tag in header_value.split(",")]
 
 
 # --- API Endpoint Definition ---
 
-@app.post("/parse", summary="Parse OSM File", response_model=Dict[str, Any])
+# response_model=None: results are streamed as NDJSON, not validated against a model
+@app.post("/parse", summary="Parse OSM File", response_model=None)
 async def parse_osm(
-    background_tasks: BackgroundTasks,
+    request: Request,
     file: UploadFile = File(..., description="OpenStudio Model (OSM) file to parse."),
-    object_types: Optional[List[str]] = Query(
+    object_types: Optional[List[ObjectType]] = Query(
         default=None,
         description=(
             "List of specific object types to parse (e.g., 'spaces', 'surfaces', 'subsurfaces'). "
@@ -115,87 +742,78 @@ async def parse_osm(
     )
 ):
     temp_osm_path: Optional[str] = None
-    # Initialize results with None for all defined VALID_OBJECT_TYPES.
-    results: Dict[str, Any] = {obj_type: None for obj_type in VALID_OBJECT_TYPES}
 
     try:
-        file_content = await file.read()
-        if not file_content:
-            raise HTTPException(status_code=400, detail="Uploaded file is empty.")
-        
-
-        temp_osm_path = save_temp_file(file_content, file.filename or "model.osm")
-        background_tasks.add_task(cleanup_temp_file, temp_osm_path)
-
         types_to_parse: List[str]
         if not object_types: # If list is empty or None from query
             types_to_parse = VALID_OBJECT_TYPES
         else:
-            # Validate requested object types against our now smaller VALID_OBJECT_TYPES list
-            invalid_types = [ot for ot in object_types if ot not in VALID_OBJECT_TYPES]
-            if invalid_types:
-                raise HTTPException(
-                    status_code=400,
-                    detail=f"Invalid object type(s) requested: {', '.join(invalid_types)}. Valid types for this version are: {', '.join(VALID_OBJECT_TYPES)}"
-                )
-            types_to_parse = object_types
+            # Values were already validated against ObjectType by FastAPI; drop duplicates, keeping order
+            types_to_parse = list(dict.fromkeys(obj_type.value for obj_type in object_types))
         
-        print(f"Object types selected for parsing: {types_to_parse}")
+        log.info("Object types selected for parsing: %s", types_to_parse)
+
+        # Size checks on the already-received upload (Starlette always sets file.size for
+        # multipart uploads). Requests with an oversized Content-Length are rejected earlier
+        # by UploadSizeLimitMiddleware; this covers uploads sent without one.
+        if file.size == 0:
+            raise HTTPException(status_code=400, detail="Uploaded file is empty.")
+        if file.size > MAX_UPLOAD_BYTES:
+            raise HTTPException(
+                status_code=413,
+                detail=f"Uploaded file is too large. Maximum size is {MAX_UPLOAD_BYTES // (1024 * 1024)} MB."
+            )
+
+        if file.size <= IN_MEMORY_LOAD_MAX_BYTES:
+            # Small enough to load straight from memory, skipping the temp file write + read.
+            # Only hash it now; it stays in the spooled file until a parse permit is held.
+            content_sha = await run_in_threadpool(hash_upload, file)
+        else:
+            # Stream the upload straight to disk in a worker thread (no full in-memory copy)
+            temp_osm_path, content_sha = await run_in_threadpool(save_temp_file, file, file.filename or "model.osm")
+
+        # ETag identifies the response by parser version, upload content and requested types;
+        # clients re-sending the same file get a 304 without any parsing, until a toolkit or
+        # OpenStudio upgrade changes PARSER_VERSION.
+        # It is only sent for responses served entirely from the result cache, which
+        # holds successful results only, so a client never caches a parser error.
+        etag = f'"{PARSER_VERSION}-{content_sha[:16]}-{"-".join(sorted(types_to_parse))}"'
+        if etag in _parse_if_none_match(request.headers.get("if-none-match")):
+            log.info("ETag match, returning 304 for %s", etag)
+            return Response(status_code=304, headers={"ETag": etag})
 
         if not load_osm_file_as_model: # Check if the import for model loader worked
             raise HTTPException(status_code=501, detail="Model loading utility from toolkit is not available (import error).")
         
-        try:
-            model = load_osm_file_as_model(temp_osm_path)
-            print("OpenStudio model loaded successfully.")
-        except Exception as e_load:
-            print(f"Error loading OpenStudio model: {e_load}")
-            raise HTTPException(status_code=400, detail=f"Failed to load/translate OpenStudio model: {str(e_load)}")
+        model: Any = None
+        cached_results = await run_in_threadpool(_get_cached_results, content_sha, types_to_parse)
+        if cached_results is not None:
+            # Every parser result is already cached; the model is not needed
+            log.info("All requested object types cached; skipping model load.")
+        else:
+            try:
+                # Model loading is a long, blocking C++ call; keep it off the event loop
+                model = await _run_with_parse_permit(_load_upload_model, file, content_sha, temp_osm_path)
+                log.info("OpenStudio model loaded successfully.")
+            except Exception as e_load:
+                log.error("Error loading OpenStudio model: %s", e_load)
+                raise HTTPException(status_code=400, detail=f"Failed to load/translate OpenStudio model: {str(e_load)}")
 
         # --- Actual Parsing Logic for the defined object types ---
-        for obj_type in types_to_parse: # Only loop through types selected for parsing
-            data: Any = None
-            try:
-                print(f"Processing object type: {obj_type}")
-                
-                if obj_type == "spaces":
-                    if get_all_space_objects_as_dicts: # Check if function was imported
-                        data = get_all_space_objects_as_dicts(model)
-                    else:
-                        raise ImportError("Function 'get_all_space_objects_as_dicts' not available.")
-                elif obj_type == "surfaces":
-                    if get_all_surface_objects_as_dicts: # Check if function was imported
-                        data = get_all_surface_objects_as_dicts(model)
-                    else:
-                        raise ImportError("Function 'get_all_surface_objects_as_dicts' not available.")
-                elif obj_type == "subsurfaces":
-                    if get_all_subsurface_objects_as_dicts: # Check if function was imported
-                        data = get_all_subsurface_objects_as_dicts(model)
-                    else:
-                        raise ImportError("Function 'get_all_subsurface_objects_as_dicts' not available.")
-                # No 'else' needed here, as types_to_parse is already validated.
-                # If we add more VALID_OBJECT_TYPES later, we'll need more elif blocks.
-
-                # Data Handling: Assumes your functions return lists of dicts or dicts
-                if data is not None:
-                    results[obj_type] = data
-                else:
-                    # Function was called, returned None (e.g., no objects of this type found).
-                    # Set to an empty list to distinguish from "not selected" (which remains None from init).
-                    results[obj_type] = [] 
-
-            except ImportError as e_imp:
-                print(f"ImportError for parsing function for {obj_type}: {e_imp}")
-                results[obj_type] = {"error": f"Parsing function for {obj_type} not available: {str(e_imp)}"}
-            except Exception as e_parse:
-                print(f"Error parsing {obj_type}: {e_parse}")
-                results[obj_type] = {"error": f"Error processing {obj_type}: {str(e_parse)}"}
-        
-        # Non-selected VALID_OBJECT_TYPES will remain as 'None' in the results dict from initialization.
-        return results
+        # Each parser is an independent read of the model, so run them concurrently
+        # in worker threads and stream each result as soon as it is ready.
+        return StreamingResponse(
+            _stream_results(types_to_parse, model, content_sha, cached_results),
+            media_type="application/x-ndjson",
+            headers={"ETag": etag} if cached_results is not None else None,
+        )
 
     except HTTPException:
         raise
     except Exception as e:
-        print(f"An unexpected server error occurred: {e}")
+        log.error("An unexpected server error occurred: %s", e)
         raise HTTPException(status_code=500, detail=f"An unexpected server error occurred: {str(e)}")
+    finally:
+        # The temp copy is only needed until the model is loaded (parsers work on the model)
+        if temp_osm_path:
+            cleanup_temp_file(temp_osm_path)